@@ -0,0 +1,198 @@
+import asyncio
+import json
+import os
+import tempfile
+from datetime import datetime
+from typing import AsyncIterator
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
+
+from integrations.integration_item import IntegrationItem
+from profiling import phase
+
+EXPORT_BATCH_SIZE = 10000
+ARROW_STREAM_MEDIA_TYPE = 'application/vnd.apache.arrow.stream'
+PARQUET_MEDIA_TYPE = 'application/vnd.apache.parquet'
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+
+ITEM_SCHEMA = pa.schema([
+    ('id', pa.string()),
+    ('type', pa.dictionary(pa.int32(), pa.string())),
+    ('directory', pa.bool_()),
+    ('parent_path_or_name', pa.string()),
+    ('parent_id', pa.string()),
+    ('name', pa.string()),
+    ('creation_time', pa.timestamp('us', tz='UTC')),
+    ('last_modified_time', pa.timestamp('us', tz='UTC')),
+    ('url', pa.string()),
+    ('children', pa.list_(pa.string())),
+    ('mime_type', pa.string()),
+    ('delta', pa.string()),
+    ('drive_id', pa.string()),
+    ('visibility', pa.bool_()),
+    # Provider-specific fields such as Airtable record fields, JSON-encoded
+    ('properties', pa.string()),
+])
+
+TIMESTAMP_FIELDS = ('creation_time', 'last_modified_time')
+JSON_FIELDS = ('properties',)
+
+
+class _ChunkSink:
+    """Write-only file object that hands written bytes back to a generator"""
+
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _parse_timestamp(value):
+    """Timestamps arrive as datetimes (HubSpot, Airtable) or ISO strings (Notion, caches)"""
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def _item_values(item) -> dict:
+    if isinstance(item, IntegrationItem):
+        return vars(item)
+    return item
+
+
+def items_to_record_batch(items: list) -> pa.RecordBatch:
+    """Converts a slice of items into a typed record batch"""
+    rows = [_item_values(item) for item in items]
+    arrays = []
+    for field in ITEM_SCHEMA:
+        values = [row.get(field.name) for row in rows]
+        if field.name in TIMESTAMP_FIELDS:
+            values = [_parse_timestamp(value) for value in values]
+        elif field.name in JSON_FIELDS:
+            values = [json.dumps(jsonable_encoder(value)) if value is not None else None for value in values]
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(values, field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=ITEM_SCHEMA)
+
+
+async def _list_pages(items: list, page_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[list]:
+    for start in range(0, len(items), page_size):
+        yield items[start:start + page_size]
+
+
+async def _prefetch_first_page(pages: AsyncIterator[list]) -> AsyncIterator[list]:
+    """Awaits the first page before a response starts streaming.
+
+    Once streaming has started the status can no longer change, so fetching
+    the first page up front lets provider failures surface as error statuses;
+    a later failure aborts the stream.
+    """
+    first_page = await anext(pages, None)
+
+    async def replay():
+        try:
+            if first_page is not None:
+                yield first_page
+                async for page in pages:
+                    yield page
+        finally:
+            await pages.aclose()
+
+    return replay()
+
+
+async def iter_record_batches(
+    pages: AsyncIterator[list], batch_size: int = EXPORT_BATCH_SIZE
+) -> AsyncIterator[pa.RecordBatch]:
+    """Regroups pages of items into record batches of at least `batch_size` rows"""
+    buffer = []
+    async for page in pages:
+        buffer.extend(page)
+        if len(buffer) >= batch_size:
+            yield items_to_record_batch(buffer)
+            buffer = []
+    if buffer:
+        yield items_to_record_batch(buffer)
+
+
+async def iter_arrow_stream(pages: AsyncIterator[list]) -> AsyncIterator[bytes]:
+    """Yields an Arrow IPC stream one record batch at a time"""
+    sink = _ChunkSink()
+    with pa.ipc.new_stream(sink, ITEM_SCHEMA) as writer:
+        yield sink.drain()
+        async for batch in iter_record_batches(pages):
+            writer.write_batch(batch)
+            yield sink.drain()
+    yield sink.drain()
+
+
+async def iter_ndjson(pages: AsyncIterator[list]) -> AsyncIterator[str]:
+    """Yields one JSON object per line, one chunk per page"""
+    async for page in pages:
+        with phase('serialization'):
+            chunk = ''.join(json.dumps(jsonable_encoder(item)) + '\n' for item in page)
+        yield chunk
+
+
+async def write_parquet(pages: AsyncIterator[list], path: str) -> None:
+    """Writes one Parquet row group per record batch, off the event loop"""
+    writer = await asyncio.to_thread(pq.ParquetWriter, path, ITEM_SCHEMA)
+    try:
+        async for batch in iter_record_batches(pages):
+            await asyncio.to_thread(writer.write_batch, batch)
+    finally:
+        await asyncio.to_thread(writer.close)
+
+
+async def export_items(integration: str, items, export_format: str = 'arrow'):
+    """Streams items as Arrow IPC or NDJSON, or returns them as a Parquet file.
+
+    `items` is either a list or an async iterator of item pages, so sources
+    too large to hold in memory are exported as they are fetched.
+    """
+    if export_format not in ('arrow', 'ndjson', 'parquet'):
+        raise HTTPException(status_code=400, detail=f'Unsupported export format: {export_format}')
+    pages = items if hasattr(items, '__aiter__') else _list_pages(items or [])
+
+    if export_format == 'arrow':
+        return StreamingResponse(
+            iter_arrow_stream(await _prefetch_first_page(pages)),
+            media_type=ARROW_STREAM_MEDIA_TYPE,
+            headers={'Content-Disposition': f'attachment; filename="{integration}_items.arrows"'},
+        )
+
+    if export_format == 'ndjson':
+        return StreamingResponse(iter_ndjson(await _prefetch_first_page(pages)), media_type=NDJSON_MEDIA_TYPE)
+
+    fd, path = tempfile.mkstemp(suffix='.parquet')
+    os.close(fd)
+    try:
+        await write_parquet(pages, path)
+    except BaseException:
+        os.remove(path)
+        raise
+    return FileResponse(
+        path,
+        media_type=PARQUET_MEDIA_TYPE,
+        filename=f'{integration}_items.parquet',
+        background=BackgroundTask(os.remove, path),
+    )
@@ -9,12 +9,19 @@ import httpx
 import asyncio
 import base64
 import hashlib
+import os
+import time
+from typing import AsyncIterator
 
-import requests
-from integrations.integration_item import IntegrationItem
+import logging
+from integrations.integration_item import IntegrationItem, PartialItemList
+from profiling import phase, timed_phase
+from resilience import RateLimiter, UpstreamUnavailableError, upstream_request
 
 from redis_client import add_key_value_redis, get_value_redis, delete_key_redis
 
+logger = logging.getLogger(__name__)
+
 # CLIENT_ID = 'XXX'
 # CLIENT_SECRET = 'XXX'
 CLIENT_ID = '329147ef-ac8b-4863-bced-77b7b195258f'
@@ -25,6 +32,21 @@ authorization_url = f'https://airtable.com/oauth2/v1/authorize?client_id={CLIENT
 encoded_client_id_secret = base64.b64encode(f'{CLIENT_ID}:{CLIENT_SECRET}'.encode()).decode()
 scope = 'data.records:read data.records:write data.recordComments:read data.recordComments:write schema.bases:read schema.bases:write'
 
+# Airtable caps list-records pages at 100 and allows 5 requests per second per base
+RECORDS_PAGE_SIZE = 100
+REQUESTS_PER_SECOND_PER_BASE = 5
+RATE_LIMIT_BACKOFF_SECONDS = 30
+MAX_RATE_LIMIT_RETRIES = 3
+# Record pages buffered ahead of a slow consumer before paging pauses
+RECORDS_QUEUE_PAGES = 10
+
+# Table schemas are cached per base and only re-fetched after this interval.
+# Airtable exposes no cheap schema version, so a table change shows up at the next revalidation.
+SCHEMA_REVALIDATE_SECONDS = int(os.getenv('AIRTABLE_SCHEMA_REVALIDATE_SECONDS', 3600))
+# Floor for forced revalidations, so fields that exist on no table cannot refetch the schema on every request
+SCHEMA_MIN_REVALIDATE_SECONDS = 60
+SCHEMA_CACHE_EXPIRE_SECONDS = 7 * 24 * 3600
+
 async def authorize_airtable(user_id, org_id):
     state_data = {
         'state': secrets.token_urlsafe(32),
@@ -105,10 +127,11 @@ async def get_airtable_credentials(user_id, org_id):
 
     return credentials
 
+@timed_phase('metadata')
 def create_integration_item_metadata_object(
-    response_json: str, item_type: str, parent_id=None, parent_name=None
+    response_json: str, item_type: str, parent_id=None, parent_name=None, parent_type='Base'
 ) -> IntegrationItem:
-    parent_id = None if parent_id is None else parent_id + '_Base'
+    parent_id = None if parent_id is None else parent_id + '_' + parent_type
     integration_item_metadata = IntegrationItem(
         id=response_json.get('id', None) + '_' + item_type,
         name=response_json.get('name', None),
@@ -120,13 +143,16 @@ def create_integration_item_metadata_object(
     return integration_item_metadata
 
 
-def fetch_items(
-    access_token: str, url: str, aggregated_response: list, offset=None
-) -> dict:
-    """Fetching the list of bases"""
+async def fetch_items(
+    client: httpx.AsyncClient, access_token: str, url: str, aggregated_response: list, offset=None
+) -> bool:
+    """Fetching the list of bases, returns whether every page was fetched"""
     params = {'offset': offset} if offset is not None else {}
     headers = {'Authorization': f'Bearer {access_token}'}
-    response = requests.get(url, headers=headers, params=params)
+    with phase('upstream'):
+        response = await upstream_request(
+            client, 'airtable', 'bases', 'GET', url, hedge=True, headers=headers, params=params
+        )
 
     if response.status_code == 200:
         results = response.json().get('bases', {})
@@ -136,36 +162,355 @@ def fetch_items(
             aggregated_response.append(item)
 
         if offset is not None:
-            fetch_items(access_token, url, aggregated_response, offset)
+            return await fetch_items(client, access_token, url, aggregated_response, offset)
         else:
-            return
+            return True
+
+    logger.error(f'Failed to fetch Airtable bases: {response.text}')
+    return False
 
 
 async def get_items_airtable(credentials) -> list[IntegrationItem]:
+    """Aggregates bases and tables, as a PartialItemList when a listing could not be fetched"""
     credentials = json.loads(credentials)
     url = 'https://api.airtable.com/v0/meta/bases'
     list_of_integration_item_metadata = []
     list_of_responses = []
 
-    fetch_items(credentials.get('access_token'), url, list_of_responses)
-    for response in list_of_responses:
+    async with httpx.AsyncClient() as client:
+        complete = await fetch_items(client, credentials.get('access_token'), url, list_of_responses)
+        list_of_tables = await asyncio.gather(*[
+            fetch_base_tables(client, credentials.get('access_token'), response)
+            for response in list_of_responses
+        ])
+
+    for response, tables in zip(list_of_responses, list_of_tables):
         list_of_integration_item_metadata.append(
             create_integration_item_metadata_object(response, 'Base')
         )
-        tables_response = requests.get(
-            f'https://api.airtable.com/v0/meta/bases/{response.get("id")}/tables',
-            headers={'Authorization': f'Bearer {credentials.get("access_token")}'},
-        )
-        if tables_response.status_code == 200:
-            tables_response = tables_response.json()
-            for table in tables_response['tables']:
-                list_of_integration_item_metadata.append(
-                    create_integration_item_metadata_object(
-                        table,
-                        'Table',
-                        response.get('id', None),
-                        response.get('name', None),
-                    )
+        if tables is None:
+            complete = False
+            continue
+        for table in tables:
+            list_of_integration_item_metadata.append(
+                create_integration_item_metadata_object(
+                    table,
+                    'Table',
+                    response.get('id', None),
+                    response.get('name', None),
                 )
+            )
 
+    if not complete:
+        return PartialItemList(list_of_integration_item_metadata)
     return list_of_integration_item_metadata
+
+
+@timed_phase('metadata')
+def create_record_item_metadata_object(
+    record: dict, table: dict, primary_field_name=None, projected_fields=None
+) -> IntegrationItem:
+    """Creates an integration metadata object for a table record"""
+    fields = record.get('fields', {})
+    name = fields.get(primary_field_name) if primary_field_name else None
+    created_time = record.get('createdTime')
+    if projected_fields is not None:
+        fields = {field: fields[field] for field in projected_fields if field in fields}
+
+    return IntegrationItem(
+        id=record.get('id') + '_Record',
+        name=str(name) if name is not None else record.get('id'),
+        type='Record',
+        parent_id=table.get('id') + '_Table',
+        parent_path_or_name=table.get('name'),
+        creation_time=(
+            datetime.datetime.fromisoformat(created_time.replace('Z', '+00:00'))
+            if created_time else None
+        ),
+        properties=fields,
+    )
+
+
+def _project_fields(table: dict, fields=None):
+    """Keeps only the requested fields that exist on the table.
+
+    Airtable rejects the whole request when `fields[]` names an unknown field,
+    so a projection shared across tables has to be narrowed per table.
+    Returns None when no projection was requested.
+    """
+    if not fields:
+        return None
+    table_fields = {field.get('name') for field in table.get('fields', [])}
+    return [field for field in fields if field in table_fields]
+
+
+def _fingerprint(payload) -> str:
+    """Stable hash of a JSON payload"""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+_base_limiters = {}
+
+
+def get_base_limiter(base_id: str) -> RateLimiter:
+    """Rate limiter shared by every request this process sends to a base"""
+    if base_id not in _base_limiters:
+        _base_limiters[base_id] = RateLimiter(REQUESTS_PER_SECOND_PER_BASE)
+    return _base_limiters[base_id]
+
+
+async def fetch_base_tables(
+    client: httpx.AsyncClient, access_token: str, base: dict, force_refresh: bool = False
+) -> list:
+    """Fetching the table schemas of a base through a per-base TTL cache.
+
+    A cached schema is reused while it was validated less than
+    SCHEMA_REVALIDATE_SECONDS ago and the base id and name are unchanged; the
+    base listing carries nothing that changes with the tables themselves.
+    `force_refresh` revalidates early once the schema is older than
+    SCHEMA_MIN_REVALIDATE_SECONDS, for callers that found it stale. The
+    cached schema is served when Airtable cannot be reached or refuses the
+    request; without one, None is returned so the tables are not mistaken
+    for an empty base.
+    """
+    base_id = base.get('id')
+    cache_key = f'airtable_schema:{base_id}'
+    base_fingerprint = _fingerprint({'id': base_id, 'name': base.get('name')})
+
+    cached = await get_value_redis(cache_key)
+    cached = json.loads(cached) if cached else None
+    max_age = SCHEMA_MIN_REVALIDATE_SECONDS if force_refresh else SCHEMA_REVALIDATE_SECONDS
+    if (
+        cached
+        and cached.get('base_fingerprint') == base_fingerprint
+        and time.time() - cached.get('validated_at', 0) < max_age
+    ):
+        return cached['tables']
+
+    try:
+        async with get_base_limiter(base_id) as limiter:
+            with phase('upstream'):
+                response = await upstream_request(
+                    client,
+                    'airtable',
+                    'tables',
+                    'GET',
+                    f'https://api.airtable.com/v0/meta/bases/{base_id}/tables',
+                    hedge=True,
+                    budget=limiter,
+                    headers={'Authorization': f'Bearer {access_token}'},
+                )
+    except UpstreamUnavailableError:
+        if not cached:
+            raise
+        logger.info(f'Serving cached Airtable schema for base {base_id}')
+        return cached['tables']
+    if response.status_code != 200:
+        logger.error(f'Failed to fetch tables of base {base_id}: {response.text}')
+        return cached['tables'] if cached else None
+
+    tables = response.json().get('tables', [])
+    await add_key_value_redis(
+        cache_key,
+        json.dumps({
+            'base_fingerprint': base_fingerprint,
+            'validated_at': time.time(),
+            'tables': tables,
+        }),
+        expire=SCHEMA_CACHE_EXPIRE_SECONDS,
+    )
+    return tables
+
+
+def _record_params(table: dict, fields=None):
+    """Returns the primary field name, projected fields and list-records params of a table.
+
+    The params are None when the table holds none of the requested fields.
+    """
+    primary_field_name = next(
+        (field.get('name') for field in table.get('fields', []) if field.get('id') == table.get('primaryFieldId')),
+        None,
+    )
+    projected_fields = _project_fields(table, fields)
+    params = [('pageSize', RECORDS_PAGE_SIZE)]
+    if projected_fields is not None:
+        if not projected_fields:
+            return primary_field_name, projected_fields, None
+        params += [('fields[]', field) for field in projected_fields]
+        # The primary field is always fetched so records keep their name
+        if primary_field_name and primary_field_name not in projected_fields:
+            params.append(('fields[]', primary_field_name))
+    return primary_field_name, projected_fields, params
+
+
+def _is_unknown_field_error(response: httpx.Response) -> bool:
+    if response.status_code != 422:
+        return False
+    try:
+        error = response.json().get('error')
+    except ValueError:
+        return False
+    return isinstance(error, dict) and error.get('type') == 'UNKNOWN_FIELD_NAME'
+
+
+async def fetch_table_records(
+    client: httpx.AsyncClient,
+    access_token: str,
+    base: dict,
+    table: dict,
+    fields=None,
+) -> AsyncIterator[list[IntegrationItem]]:
+    """Pages through every record of a table following `offset` cursors.
+
+    Pages of one table are fetched in order since each cursor comes from the
+    previous page, and each page is yielded as soon as it arrives. Every
+    request, hedges included, draws from the base's rate limiter so tables
+    can be paged concurrently within Airtable's per-base limit.
+    Tables holding none of the requested fields are skipped. When Airtable
+    rejects a projected field the cached schema was stale, so it is
+    revalidated and the page retried once with the projection redone.
+    """
+    base_id = base.get('id')
+    url = f'https://api.airtable.com/v0/{base_id}/{table.get("id")}'
+    headers = {'Authorization': f'Bearer {access_token}'}
+    primary_field_name, projected_fields, params = _record_params(table, fields)
+    if params is None:
+        return
+
+    limiter = get_base_limiter(base_id)
+    offset = None
+    rate_limit_retries = 0
+    schema_revalidated = False
+    while True:
+        page_params = params + ([('offset', offset)] if offset is not None else [])
+        async with limiter:
+            with phase('upstream'):
+                response = await upstream_request(
+                    client,
+                    'airtable',
+                    'records',
+                    'GET',
+                    url,
+                    hedge=True,
+                    budget=limiter,
+                    headers=headers,
+                    params=page_params,
+                )
+
+        if response.status_code == 429 and rate_limit_retries < MAX_RATE_LIMIT_RETRIES:
+            rate_limit_retries += 1
+            await asyncio.sleep(RATE_LIMIT_BACKOFF_SECONDS)
+            continue
+        if _is_unknown_field_error(response) and not schema_revalidated:
+            schema_revalidated = True
+            logger.info(f'Revalidating Airtable schema of base {base_id}: {response.text}')
+            tables = await fetch_base_tables(client, access_token, base, force_refresh=True)
+            if tables is None:
+                raise HTTPException(status_code=502, detail=f'Failed to fetch tables of base {base_id}')
+            table = next((candidate for candidate in tables if candidate.get('id') == table.get('id')), None)
+            if table is None:
+                return
+            primary_field_name, projected_fields, params = _record_params(table, fields)
+            if params is None:
+                return
+            continue
+        if response.status_code != 200:
+            logger.error(f'Failed to fetch records of table {table.get("id")} in base {base_id}: {response.text}')
+            raise HTTPException(status_code=502, detail=f'Failed to fetch records of table {table.get("id")}')
+        rate_limit_retries = 0
+
+        response_json = response.json()
+        yield [
+            create_record_item_metadata_object(record, table, primary_field_name, projected_fields)
+            for record in response_json.get('records', [])
+        ]
+
+        offset = response_json.get('offset')
+        if offset is None:
+            break
+
+
+async def fetch_projected_tables(client: httpx.AsyncClient, access_token: str, base: dict, fields=None) -> list:
+    """Fetches the tables of a base, revalidating the schema when a requested field is on none of them.
+
+    A field added since the schema was cached would otherwise be dropped from
+    the projection without notice.
+    """
+    tables = await fetch_base_tables(client, access_token, base)
+    if tables is None:
+        raise HTTPException(status_code=502, detail=f'Failed to fetch tables of base {base.get("id")}')
+    known_fields = {field.get('name') for table in tables for field in table.get('fields', [])}
+    if fields and not set(fields) <= known_fields:
+        tables = await fetch_base_tables(client, access_token, base, force_refresh=True) or tables
+    return tables
+
+
+async def _merge_pages(page_iterators: list) -> AsyncIterator[list]:
+    """Yields pages from several async page iterators, in arrival order.
+
+    Each iterator is drained by its own task into a bounded queue, so paging
+    pauses while the consumer falls behind. The first failure is raised and
+    the remaining tasks are cancelled, as they are when the consumer stops.
+    """
+    queue = asyncio.Queue(maxsize=RECORDS_QUEUE_PAGES)
+    finished = object()
+
+    async def drain(pages):
+        try:
+            async for page in pages:
+                await queue.put(page)
+            await queue.put(finished)
+        except Exception as e:
+            await queue.put(e)
+
+    tasks = [asyncio.create_task(drain(pages)) for pages in page_iterators]
+    try:
+        running = len(tasks)
+        while running:
+            page = await queue.get()
+            if page is finished:
+                running -= 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                yield page
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _gather_all(*coroutines) -> list:
+    """Like asyncio.gather, but lets every coroutine finish before raising the first failure"""
+    results = await asyncio.gather(*coroutines, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+async def get_records_airtable(credentials, fields=None, base_ids=None) -> AsyncIterator[list[IntegrationItem]]:
+    """Yields pages of records of every table, optionally limited to `fields` and `base_ids`.
+
+    Tables of all bases are paged concurrently and pages are yielded as they
+    arrive, so the records are never held in memory all at once.
+    """
+    credentials = json.loads(credentials)
+    access_token = credentials.get('access_token')
+    list_of_responses = []
+
+    async with httpx.AsyncClient() as client:
+        if not await fetch_items(client, access_token, 'https://api.airtable.com/v0/meta/bases', list_of_responses):
+            raise HTTPException(status_code=502, detail='Failed to fetch Airtable bases')
+        if base_ids:
+            list_of_responses = [base for base in list_of_responses if base.get('id') in base_ids]
+
+        list_of_tables = await _gather_all(*[
+            fetch_projected_tables(client, access_token, base, fields)
+            for base in list_of_responses
+        ])
+        async for page in _merge_pages([
+            fetch_table_records(client, access_token, base, table, fields)
+            for base, tables in zip(list_of_responses, list_of_tables)
+            for table in tables
+        ]):
+            yield page
@@ -1,13 +1,17 @@
 import json
 import secrets
 import logging
+import asyncio
+import codecs
 from urllib.parse import quote
-from fastapi import Request, HTTPException
+from fastapi import Request, HTTPException, UploadFile
 from fastapi.responses import HTMLResponse
 import httpx
 from datetime import datetime
 from redis_client import add_key_value_redis, get_value_redis, delete_key_redis
 from integrations.integration_item import IntegrationItem
+from profiling import phase, timed_phase
+from resilience import RateLimiter, UpstreamUnavailableError, upstream_request
 import os
 from dotenv import load_dotenv
 from store import db
@@ -31,6 +35,26 @@ REQUIRED_SCOPES = [
 
 HUBSPOT_OBJECTS=['contacts']
 
+# Batch endpoints accept at most 100 inputs; OAuth apps get 100 requests per 10 seconds
+BATCH_SIZE = 100
+MAX_CONCURRENT_BATCHES = 5
+MAX_BATCH_RETRIES = 3
+RATE_LIMIT_REQUESTS = 100
+RATE_LIMIT_PERIOD_SECONDS = 10
+FORMAT_SNIFF_BYTES = 1024
+UPLOAD_CHUNK_BYTES = 64 * 1024
+
+_account_limiters = {}
+
+
+def get_account_limiter(account_id: str) -> RateLimiter:
+    """
+    Rate limiter shared by every request this process sends for a HubSpot account
+    """
+    if account_id not in _account_limiters:
+        _account_limiters[account_id] = RateLimiter(RATE_LIMIT_REQUESTS, per=RATE_LIMIT_PERIOD_SECONDS)
+    return _account_limiters[account_id]
+
 
 def get_authorization_url(state: str) -> str:
     """
@@ -173,6 +197,7 @@ async def get_hubspot_credentials(user_id, org_id):
         logger.error(f"Error retrieving credentials: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to retrieve credentials")
 
+@timed_phase('metadata')
 def create_integration_item_metadata_object(
     response_json: dict,
     item_type: str,
@@ -232,11 +257,20 @@ async def get_items_hubspot(credentials: str) -> list[IntegrationItem]:
                 logger.info("Returning items from cache")
                 return json.loads(cached_items)
 
+            limiter = get_account_limiter(hubspot_user_id or access_token)
             for object in HUBSPOT_OBJECTS:
-                response = await client.get(
-                    f'https://api.hubspot.com/crm/v3/objects/{object}',
-                    headers=headers,
-                )
+                async with limiter:
+                    with phase('upstream'):
+                        response = await upstream_request(
+                            client,
+                            'hubspot',
+                            'objects',
+                            'GET',
+                            f'https://api.hubspot.com/crm/v3/objects/{object}',
+                            hedge=True,
+                            budget=limiter,
+                            headers=headers,
+                        )
 
                 if response.status_code != 200:
                     logger.error(f"Failed to fetch contacts: {response.text}")
@@ -256,6 +290,8 @@ async def get_items_hubspot(credentials: str) -> list[IntegrationItem]:
                 logger.info(items_dict)
 
         return list_of_integration_items
+    except UpstreamUnavailableError:
+        raise
     except Exception as e:
         logger.error(f"Error fetching HubSpot items: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to fetch HubSpot items")
@@ -272,3 +308,199 @@ async def invalidate_hubspot_cache(request: Request):
     except Exception as e:
         logger.error(f"Error invalidating HubSpot cache: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to invalidate cache")
+
+
+async def _iter_lines(contacts: UploadFile):
+    """
+    Yield the lines of an upload, read in chunks so disk-backed uploads never block the event loop
+    """
+    pending = b''
+    while chunk := await contacts.read(UPLOAD_CHUNK_BYTES):
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+async def _iter_contacts(contacts: UploadFile):
+    """
+    Yield (position, contact, error) from a JSON array or newline-delimited JSON upload
+
+    Only newline-delimited JSON is streamed; a JSON array is loaded whole.
+    Entries that are not JSON objects are yielded with an error instead of a contact.
+    """
+    prefix = await contacts.read(FORMAT_SNIFF_BYTES)
+    await contacts.seek(0)
+    if prefix.lstrip().removeprefix(codecs.BOM_UTF8).lstrip()[:1] == b'[':
+        try:
+            entries = json.loads((await contacts.read()).decode('utf-8-sig'))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f'Invalid JSON array: {str(e)}')
+        for position, contact in enumerate(entries, start=1):
+            if isinstance(contact, dict):
+                yield position, contact, None
+            else:
+                yield position, None, 'Contact is not a JSON object'
+        return
+
+    position = 0
+    async for line in _iter_lines(contacts):
+        position += 1
+        if not line.strip():
+            continue
+        try:
+            contact = json.loads(line.decode('utf-8-sig'))
+        except ValueError:
+            yield position, None, 'Invalid JSON'
+            continue
+        if isinstance(contact, dict):
+            yield position, contact, None
+        else:
+            yield position, None, 'Contact is not a JSON object'
+
+def _batch_error_ids(error: dict) -> set:
+    """
+    Collect the record ids a HubSpot batch error refers to
+    """
+    ids = set()
+    for values in error.get('context', {}).values():
+        if isinstance(values, list):
+            ids.update(str(value) for value in values)
+    return ids
+
+async def _upsert_contacts_batch(
+    client: httpx.AsyncClient,
+    headers: dict,
+    batch: list,
+    id_property: str,
+    limiter: RateLimiter,
+) -> tuple[int, list]:
+    """
+    Upsert one batch and return the success count and per-record failures
+    """
+    inputs = [
+        {'idProperty': id_property, 'id': str(properties[id_property]), 'properties': properties}
+        for properties in batch
+    ]
+
+    for attempt in range(MAX_BATCH_RETRIES + 1):
+        try:
+            async with limiter:
+                with phase('upstream'):
+                    response = await upstream_request(
+                        client,
+                        'hubspot',
+                        'batch_upsert',
+                        'POST',
+                        'https://api.hubspot.com/crm/v3/objects/contacts/batch/upsert',
+                        headers=headers,
+                        json={'inputs': inputs},
+                    )
+        except UpstreamUnavailableError as e:
+            return 0, [{'id': item['id'], 'status': 503, 'message': str(e)} for item in inputs]
+        if response.status_code != 429 or attempt == MAX_BATCH_RETRIES:
+            break
+        await asyncio.sleep(float(response.headers.get('Retry-After', 2 ** attempt)))
+
+    if response.status_code not in (200, 201, 207):
+        logger.error(f"Failed to upsert contacts batch: {response.text}")
+        return 0, [
+            {'id': item['id'], 'status': response.status_code, 'message': response.text}
+            for item in inputs
+        ]
+
+    response_json = response.json()
+    failures = []
+    unmatched_errors = []
+    input_ids = {item['id'] for item in inputs}
+    for error in response_json.get('errors', []):
+        error_ids = _batch_error_ids(error) & input_ids
+        if not error_ids:
+            unmatched_errors.append(error)
+        failures.extend(
+            {'id': record_id, 'status': error.get('status'), 'message': error.get('message')}
+            for record_id in sorted(error_ids)
+        )
+    for error in unmatched_errors:
+        failures.append({'id': None, 'status': error.get('status'), 'message': error.get('message')})
+
+    return len(response_json.get('results', [])), failures
+
+async def upsert_contacts_hubspot(credentials: str, contacts: UploadFile, id_property: str = 'email') -> dict:
+    """
+    Bulk upsert contacts through the HubSpot batch endpoint and invalidate the items cache
+    """
+    try:
+        credentials_data = json.loads(credentials)
+        access_token = credentials_data.get('access_token')
+        org_id = credentials_data.get('org_id')
+        user_id = credentials_data.get('user_id')
+        hubspot_user_id = db.get_hubspot_user_id(user_id, org_id)
+
+        if not access_token:
+            logger.error("Invalid credentials - missing access token")
+            raise HTTPException(status_code=400, detail='Invalid credentials')
+
+        headers = {
+            'Authorization': f'Bearer {access_token}',
+            'Content-Type': 'application/json'
+        }
+
+        # The semaphore bounds batches held in memory, the limiter the account's request rate
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_BATCHES)
+        limiter = get_account_limiter(hubspot_user_id or access_token)
+        tasks = []
+        failures = []
+        total = 0
+        succeeded = 0
+
+        async with httpx.AsyncClient() as client:
+            async def run_batch(batch):
+                try:
+                    return await _upsert_contacts_batch(client, headers, batch, id_property, limiter)
+                except Exception as e:
+                    logger.error(f"Error upserting contacts batch: {str(e)}")
+                    return 0, [
+                        {'id': str(properties[id_property]), 'status': 500, 'message': str(e)}
+                        for properties in batch
+                    ]
+                finally:
+                    semaphore.release()
+
+            async def dispatch(batch):
+                # Acquiring before scheduling keeps at most MAX_CONCURRENT_BATCHES in memory
+                await semaphore.acquire()
+                tasks.append(asyncio.create_task(run_batch(batch)))
+
+            try:
+                batch = []
+                async for position, properties, error in _iter_contacts(contacts):
+                    total += 1
+                    if error is None and not properties.get(id_property):
+                        error = f'Missing {id_property}'
+                    if error is not None:
+                        failures.append({'id': None, 'position': position, 'status': 'INVALID_INPUT', 'message': error})
+                        continue
+                    batch.append(properties)
+                    if len(batch) == BATCH_SIZE:
+                        await dispatch(batch)
+                        batch = []
+                if batch:
+                    await dispatch(batch)
+            finally:
+                # Dispatched batches are applied upstream whatever happens to the rest of the upload
+                for batch_succeeded, batch_failures in await asyncio.gather(*tasks):
+                    succeeded += batch_succeeded
+                    failures.extend(batch_failures)
+                if succeeded:
+                    await delete_key_redis(f'hubspot_items:{hubspot_user_id}')
+
+        logger.info(f"Upserted {succeeded} of {total} contacts for HubSpot user {hubspot_user_id}")
+
+        return {'total': total, 'succeeded': succeeded, 'failed': len(failures), 'errors': failures}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error upserting HubSpot contacts: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to upsert HubSpot contacts")
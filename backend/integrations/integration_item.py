@@ -1,5 +1,7 @@
 from datetime import datetime
-from typing import Optional, List
+from typing import Any, Dict, Optional, List
+
+from profiling import timed_phase
 
 class IntegrationItem:
     def __init__(
@@ -18,6 +20,7 @@ class IntegrationItem:
         delta: Optional[str] = None,
         drive_id: Optional[str] = None,
         visibility: Optional[bool] = True,
+        properties: Optional[Dict[str, Any]] = None,
     ):
         self.id = id
         self.type = type
@@ -33,7 +36,9 @@ class IntegrationItem:
         self.delta = delta
         self.drive_id = drive_id
         self.visibility = visibility
+        self.properties = properties
 
+    @timed_phase('serialization')
     def to_dict(self):
         """Convert IntegrationItem to a dictionary that can be JSON serialized"""
         return {
@@ -43,12 +48,21 @@ class IntegrationItem:
             'parent_path_or_name': self.parent_path_or_name,
             'parent_id': self.parent_id,
             'name': self.name,
-            'creation_time': self.creation_time.isoformat() if self.creation_time else None,
-            'last_modified_time': self.last_modified_time.isoformat() if self.last_modified_time else None,
+            'creation_time': self.creation_time.isoformat() if isinstance(self.creation_time, datetime) else self.creation_time,
+            'last_modified_time': self.last_modified_time.isoformat() if isinstance(self.last_modified_time, datetime) else self.last_modified_time,
             'url': self.url,
             'children': self.children,
             'mime_type': self.mime_type,
             'delta': self.delta,
             'drive_id': self.drive_id,
-            'visibility': self.visibility
+            'visibility': self.visibility,
+            'properties': self.properties,
         }
+
+
+class PartialItemList(list):
+    """Items of a load that could not be fetched completely.
+
+    They are still served, but must not replace a cached snapshot or be
+    diffed against one, since missing items would read as removed.
+    """
@@ -7,20 +7,34 @@ from fastapi.responses import HTMLResponse
 import httpx
 import asyncio
 import base64
-import requests
-from integrations.integration_item import IntegrationItem
+import logging
+from integrations.integration_item import IntegrationItem, PartialItemList
+from profiling import phase, timed_phase
+from resilience import UpstreamUnavailableError, upstream_request
 
 from redis_client import add_key_value_redis, get_value_redis, delete_key_redis
 
 import os
 from dotenv import load_dotenv
 
+logger = logging.getLogger(__name__)
+
 load_dotenv()
 
 CLIENT_ID = os.getenv('NOTION_CLIENT_ID')
 CLIENT_SECRET = os.getenv('NOTION_CLIENT_SECRET')
 encoded_client_id_secret = base64.b64encode(f'{CLIENT_ID}:{CLIENT_SECRET}'.encode()).decode()
 
+NOTION_VERSION = '2022-06-28'
+
+# Block traversal limits; Notion allows an average of 3 requests per second per integration
+BLOCK_PAGE_SIZE = 100
+MAX_CONCURRENT_BLOCK_REQUESTS = 3
+MAX_BLOCK_DEPTH = 10
+MAX_BLOCKS = 10000
+RATE_LIMIT_BACKOFF_SECONDS = 1
+MAX_RATE_LIMIT_RETRIES = 3
+
 REDIRECT_URI = 'http://localhost:8000/integrations/notion/oauth2callback'
 authorization_url = f'https://api.notion.com/v1/oauth/authorize?client_id=1f6d872b-594c-807f-9b9e-0037fa51de5c&response_type=code&owner=user&redirect_uri=http%3A%2F%2Flocalhost%3A8000%2Fintegrations%2Fnotion%2Foauth2callback'
 
@@ -89,6 +103,7 @@ async def get_notion_credentials(user_id, org_id):
     await delete_key_redis(f'notion_credentials:{org_id}:{user_id}')
     return credentials
 
+@timed_phase('dict_search')
 def _recursive_dict_search(data, target_key):
     """Recursively search for a key in a dictionary of dictionaries."""
     if target_key in data:
@@ -107,6 +122,7 @@ def _recursive_dict_search(data, target_key):
                         return result
     return None
 
+@timed_phase('metadata')
 def create_integration_item_metadata_object(
     response_json: str,
 ) -> IntegrationItem:
@@ -139,16 +155,170 @@ def create_integration_item_metadata_object(
 
     return integration_item_metadata
 
-async def get_items_notion(credentials) -> list[IntegrationItem]:
+@timed_phase('metadata')
+def create_block_item_metadata_object(block: dict, parent_id: str) -> IntegrationItem:
+    """creates an integration metadata object from a block"""
+    block_type = block.get('type', '')
+    content = block.get(block_type, {}) if isinstance(block.get(block_type), dict) else {}
+    text = ''.join(
+        rich_text.get('plain_text', '') for rich_text in content.get('rich_text', [])
+    ) or content.get('title', '')
+
+    return IntegrationItem(
+        id=block['id'],
+        type='block',
+        name=f'{block_type} {text}'.strip(),
+        creation_time=block.get('created_time'),
+        last_modified_time=block.get('last_edited_time'),
+        parent_id=parent_id,
+        mime_type=block_type,
+        children=[] if block.get('has_children') else None,
+    )
+
+async def fetch_block_children(
+    client: httpx.AsyncClient, access_token: str, block_id: str, semaphore: asyncio.Semaphore, remaining=None
+) -> tuple[list, bool]:
+    """Fetches every child of a block, following `next_cursor` pagination.
+
+    `remaining` returns how many more blocks the caller accepts; paging stops
+    once it reaches zero. Returns the children and whether all of them were
+    fetched, which is not the case when paging stopped early or failed.
+    """
+    headers = {
+        'Authorization': f'Bearer {access_token}',
+        'Notion-Version': NOTION_VERSION,
+    }
+    children = []
+    start_cursor = None
+    rate_limit_retries = 0
+    while True:
+        params = {'page_size': BLOCK_PAGE_SIZE}
+        if start_cursor is not None:
+            params['start_cursor'] = start_cursor
+        async with semaphore:
+            if remaining is not None and remaining() - len(children) <= 0:
+                return children, False
+            with phase('upstream'):
+                response = await upstream_request(
+                    client,
+                    'notion',
+                    'block_children',
+                    'GET',
+                    f'https://api.notion.com/v1/blocks/{block_id}/children',
+                    hedge=True,
+                    budget=semaphore,
+                    headers=headers,
+                    params=params,
+                )
+
+        if response.status_code == 429 and rate_limit_retries < MAX_RATE_LIMIT_RETRIES:
+            rate_limit_retries += 1
+            await asyncio.sleep(float(response.headers.get('Retry-After', RATE_LIMIT_BACKOFF_SECONDS)))
+            continue
+        if response.status_code != 200:
+            logger.error(f"Failed to fetch children of block {block_id}: {response.text}")
+            return children, False
+        rate_limit_retries = 0
+
+        response_json = response.json()
+        children.extend(response_json.get('results', []))
+        if not response_json.get('has_more'):
+            return children, True
+        start_cursor = response_json.get('next_cursor')
+
+async def traverse_block_tree(
+    access_token: str,
+    root_items: list[IntegrationItem],
+    max_depth: int = MAX_BLOCK_DEPTH,
+    max_blocks: int = MAX_BLOCKS,
+    concurrency: int = MAX_CONCURRENT_BLOCK_REQUESTS,
+) -> list[IntegrationItem]:
+    """Walks the block trees below `root_items` breadth-first.
+
+    Each level is fetched concurrently through a bounded pool of requests.
+    Blocks are linked to their parents through `parent_id` and the parents'
+    `children`, and a block reached twice (e.g. a synced block) is only
+    expanded once. Children are linked as soon as their fetch returns, so no
+    further pages are requested once `max_blocks` is reached. A subtree whose
+    fetch fails is left out; when anything was left out or the limits cut
+    the walk short, the blocks collected so far are returned as a
+    `PartialItemList`.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    items_by_id = {item.id: item for item in root_items}
+    visited = set(items_by_id)
+    block_items = []
+    frontier = list(items_by_id)
+    depth = 0
+    complete = True
+
+    def remaining() -> int:
+        return max_blocks - len(block_items)
+
+    async def expand(parent_id: str) -> list:
+        nonlocal complete
+        try:
+            children, fetched_all = await fetch_block_children(client, access_token, parent_id, semaphore, remaining)
+        except UpstreamUnavailableError as e:
+            logger.error(f"Skipping children of block {parent_id}: {str(e)}")
+            complete = False
+            return []
+        if not fetched_all:
+            complete = False
+
+        parent = items_by_id[parent_id]
+        if parent.children is None:
+            parent.children = []
+        expandable = []
+        for block in children:
+            if block['id'] in visited:
+                continue
+            if remaining() <= 0:
+                complete = False
+                break
+            visited.add(block['id'])
+
+            item = create_block_item_metadata_object(block, parent_id)
+            items_by_id[item.id] = item
+            block_items.append(item)
+            parent.children.append(item.id)
+
+            # Child databases are not readable through the blocks endpoint
+            if block.get('has_children') and block.get('type') != 'child_database':
+                expandable.append(item.id)
+        return expandable
+
+    async with httpx.AsyncClient() as client:
+        while frontier and depth < max_depth and remaining() > 0:
+            results = await asyncio.gather(*[expand(block_id) for block_id in frontier], return_exceptions=True)
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+
+            frontier = [block_id for expandable in results for block_id in expandable]
+            depth += 1
+
+    if frontier or not complete:
+        return PartialItemList(block_items)
+    return block_items
+
+async def get_items_notion(credentials, include_blocks: bool = False) -> list[IntegrationItem]:
     """Aggregates all metadata relevant for a notion integration"""
     credentials = json.loads(credentials)
-    response = requests.post(
-        'https://api.notion.com/v1/search',
-        headers={
-            'Authorization': f'Bearer {credentials.get("access_token")}',
-            'Notion-Version': '2022-06-28',
-        },
-    )
+    async with httpx.AsyncClient() as client:
+        with phase('upstream'):
+            response = await upstream_request(
+                client,
+                'notion',
+                'search',
+                'POST',
+                'https://api.notion.com/v1/search',
+                hedge=True,
+                headers={
+                    'Authorization': f'Bearer {credentials.get("access_token")}',
+                    'Notion-Version': NOTION_VERSION,
+                },
+            )
     if response.status_code == 200:
         results = response.json()['results']
         list_of_integration_item_metadata = []
@@ -156,5 +326,10 @@ async def get_items_notion(credentials) -> list[IntegrationItem]:
             list_of_integration_item_metadata.append(
                 create_integration_item_metadata_object(result)
             )
-        return list_of_integration_item_metadata
-    
+        if include_blocks:
+            pages = [item for item in list_of_integration_item_metadata if item.type == 'page']
+            block_items = await traverse_block_tree(credentials.get('access_token'), pages)
+            list_of_integration_item_metadata.extend(block_items)
+            if isinstance(block_items, PartialItemList):
+                return PartialItemList(list_of_integration_item_metadata)
+        return list_of_integration_item_metadata
\ No newline at end of file
@@ -1,9 +1,18 @@
-from fastapi import FastAPI, Form, Request, APIRouter
+import json
+from typing import List, Optional
+
+from fastapi import FastAPI, File, Form, Request, Response, APIRouter, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+
+from export import export_items
+from profiling import PROFILING_ENABLED, json_response, profiling_middleware
+from resilience import UpstreamUnavailableError, load_with_fallback
+from snapshots import INCOMPLETE_HEADER, SNAPSHOT_VERSION_HEADER, serve_items
 
-from integrations.airtable import authorize_airtable, get_items_airtable, oauth2callback_airtable, get_airtable_credentials
+from integrations.airtable import authorize_airtable, get_items_airtable, oauth2callback_airtable, get_airtable_credentials, get_records_airtable
 from integrations.notion import authorize_notion, get_items_notion, oauth2callback_notion, get_notion_credentials
-from integrations.hubspot import authorize_hubspot, get_hubspot_credentials, get_items_hubspot, oauth2callback_hubspot, invalidate_hubspot_cache
+from integrations.hubspot import authorize_hubspot, get_hubspot_credentials, get_items_hubspot, oauth2callback_hubspot, invalidate_hubspot_cache, upsert_contacts_hubspot
 
 app = FastAPI()
 
@@ -19,8 +28,17 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Profile-Id", SNAPSHOT_VERSION_HEADER, INCOMPLETE_HEADER],
 )
 
+# Only registered when configured so unprofiled deployments pay nothing
+if PROFILING_ENABLED:
+    app.middleware('http')(profiling_middleware)
+
+@app.exception_handler(UpstreamUnavailableError)
+async def upstream_unavailable_handler(request: Request, exc: UpstreamUnavailableError):
+    return JSONResponse(status_code=503, content={'detail': str(exc)})
+
 @app.get('/')
 def read_root():
     return {'Ping': 'Pong'}
@@ -40,8 +58,29 @@ async def get_airtable_credentials_integration(user_id: str = Form(...), org_id:
     return await get_airtable_credentials(user_id, org_id)
 
 @app.post('/integrations/airtable/load')
-async def get_airtable_items(credentials: str = Form(...)):
-    return await get_items_airtable(credentials)
+async def get_airtable_items(
+    response: Response,
+    credentials: str = Form(...),
+    snapshot_version: Optional[str] = Form(None),
+    user_id: Optional[str] = Form(None),
+    org_id: Optional[str] = Form(None),
+):
+    items = await load_with_fallback('airtable', credentials, lambda: get_items_airtable(credentials))
+    items = await serve_items('airtable', items, response, snapshot_version, user_id, org_id)
+    return json_response(items, response)
+
+@app.post('/integrations/airtable/records')
+async def get_airtable_records(
+    credentials: str = Form(...),
+    fields: Optional[List[str]] = Form(None),
+    base_ids: Optional[List[str]] = Form(None),
+    format: str = Form('ndjson'),
+):
+    return await export_items('airtable_records', get_records_airtable(credentials, fields, base_ids), format)
+
+@app.post('/integrations/airtable/export')
+async def export_airtable_items(credentials: str = Form(...), format: str = Form('arrow')):
+    return await export_items('airtable', await get_items_airtable(credentials), format)
 
 
 # Notion
@@ -58,8 +97,27 @@ async def get_notion_credentials_integration(user_id: str = Form(...), org_id: s
     return await get_notion_credentials(user_id, org_id)
 
 @app.post('/integrations/notion/load')
-async def get_notion_items(credentials: str = Form(...)):
-    return await get_items_notion(credentials)
+async def get_notion_items(
+    response: Response,
+    credentials: str = Form(...),
+    include_blocks: bool = Form(False),
+    snapshot_version: Optional[str] = Form(None),
+    user_id: Optional[str] = Form(None),
+    org_id: Optional[str] = Form(None),
+):
+    items = await load_with_fallback(
+        'notion', credentials, lambda: get_items_notion(credentials, include_blocks), {'include_blocks': include_blocks}
+    )
+    items = await serve_items('notion', items, response, snapshot_version, user_id, org_id)
+    return json_response(items, response)
+
+@app.post('/integrations/notion/export')
+async def export_notion_items(
+    credentials: str = Form(...),
+    include_blocks: bool = Form(False),
+    format: str = Form('arrow'),
+):
+    return await export_items('notion', await get_items_notion(credentials, include_blocks), format)
 
 # HubSpot
 @app.post('/integrations/hubspot/authorize')
@@ -75,8 +133,29 @@ async def get_hubspot_credentials_integration(user_id: str = Form(...), org_id:
     return await get_hubspot_credentials(user_id, org_id)
 
 @app.post('/integrations/hubspot/load')
-async def get_hubspot_items(credentials: str = Form(...)):
-    return await get_items_hubspot(credentials)
+async def get_hubspot_items(
+    response: Response,
+    credentials: str = Form(...),
+    snapshot_version: Optional[str] = Form(None),
+):
+    items = await load_with_fallback('hubspot', credentials, lambda: get_items_hubspot(credentials))
+    credentials_data = json.loads(credentials)
+    items = await serve_items(
+        'hubspot', items, response, snapshot_version, credentials_data.get('user_id'), credentials_data.get('org_id')
+    )
+    return json_response(items, response)
+
+@app.post('/integrations/hubspot/export')
+async def export_hubspot_items(credentials: str = Form(...), format: str = Form('arrow')):
+    return await export_items('hubspot', await get_items_hubspot(credentials), format)
+
+@app.post('/integrations/hubspot/contacts/upsert')
+async def upsert_hubspot_contacts(
+    credentials: str = Form(...),
+    contacts: UploadFile = File(...),
+    id_property: str = Form('email'),
+):
+    return await upsert_contacts_hubspot(credentials, contacts, id_property)
 
 @app.post('/webhook')
 async def webhook(request: Request):
@@ -0,0 +1,233 @@
+import asyncio
+import contextvars
+import functools
+import hashlib
+import hmac
+import html
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+PROFILING_SECRET = os.environ.get('PROFILING_SECRET')
+PROFILE_ALL_REQUESTS = os.environ.get('PROFILE_ALL_REQUESTS') == '1'
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(os.path.dirname(__file__), 'profiles'))
+PROFILING_ENABLED = bool(PROFILING_SECRET) or PROFILE_ALL_REQUESTS
+
+PROFILE_HEADER = 'X-Profile-Signature'
+SIGNATURE_MAX_AGE_SECONDS = 300
+SAMPLE_INTERVAL_SECONDS = 0.005
+
+_phase_timings = contextvars.ContextVar('phase_timings', default=None)
+
+
+class PhaseTimings:
+    """Wall-clock time spent per phase while handling one request"""
+
+    def __init__(self):
+        self.durations = {}
+        self.active = Counter()
+        self.started = {}
+
+    def server_timing(self, total: float) -> str:
+        entries = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in self.durations.items()]
+        entries.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(entries)
+
+
+@contextmanager
+def phase(name: str):
+    """Times the enclosed block as `name` when the current request is profiled.
+
+    The clock runs from the first entry into the phase until the last nested
+    or concurrent entry leaves it, so recursive helpers and gathered requests
+    report the union of their intervals as wall time.
+    """
+    timings = _phase_timings.get()
+    if timings is None:
+        yield
+        return
+
+    if not timings.active[name]:
+        timings.started[name] = time.perf_counter()
+    timings.active[name] += 1
+    try:
+        yield
+    finally:
+        timings.active[name] -= 1
+        if not timings.active[name]:
+            elapsed = time.perf_counter() - timings.started.pop(name)
+            timings.durations[name] = timings.durations.get(name, 0.0) + elapsed
+
+
+def timed_phase(name: str):
+    """Decorator form of `phase` for sync and async functions.
+
+    Functions are returned undecorated when profiling is not configured, and
+    unprofiled requests skip `phase` after a single context variable lookup.
+    """
+    def decorator(func):
+        if not PROFILING_ENABLED:
+            return func
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if _phase_timings.get() is None:
+                    return await func(*args, **kwargs)
+                with phase(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _phase_timings.get() is None:
+                return func(*args, **kwargs)
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def json_response(content, response: Response = None) -> JSONResponse:
+    """Encodes a route result the way FastAPI would, timed as `serialization`.
+
+    Headers set on the route's injected `response` are carried over, since
+    FastAPI only merges them into responses it builds itself.
+    """
+    with phase('serialization'):
+        json_response = JSONResponse(jsonable_encoder(content))
+    if response is not None:
+        json_response.headers.raw.extend(response.headers.raw)
+    return json_response
+
+
+class StackSampler(threading.Thread):
+    """Samples the call stack of one thread at a fixed interval.
+
+    The event loop thread is shared by every in-flight request, so samples
+    from concurrent requests show up as well; profile on a quiet worker.
+    """
+
+    def __init__(self, thread_id: int, interval: float = SAMPLE_INTERVAL_SECONDS):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def verify_signature(request: Request) -> bool:
+    """Checks a `<timestamp>:<hmac>` header signed over timestamp, method and path"""
+    if not PROFILING_SECRET:
+        return False
+    signature = request.headers.get(PROFILE_HEADER, '')
+    timestamp, _, digest = signature.partition(':')
+    if not timestamp.isdigit() or abs(time.time() - int(timestamp)) > SIGNATURE_MAX_AGE_SECONDS:
+        return False
+
+    message = f'{timestamp}:{request.method}:{request.url.path}'.encode('utf-8')
+    expected = hmac.new(PROFILING_SECRET.encode('utf-8'), message, hashlib.sha256).hexdigest()
+    # compare_digest only accepts ASCII str, so arbitrary header text is compared as bytes
+    return hmac.compare_digest(expected.encode('ascii'), digest.encode('utf-8'))
+
+
+def write_folded_stacks(stacks: Counter, path: str) -> None:
+    """Writes stacks in the folded format read by flamegraph.pl and speedscope"""
+    with open(path, 'w') as f:
+        for stack, count in stacks.most_common():
+            f.write(f'{stack} {count}\n')
+
+
+def write_flamegraph_svg(stacks: Counter, path: str, title: str, width: int = 1200, row_height: int = 16) -> None:
+    """Renders sampled stacks as a static flame graph SVG"""
+    root = {'name': 'all', 'value': 0, 'children': {}}
+    for stack, count in stacks.items():
+        node = root
+        node['value'] += count
+        for frame in stack.split(';'):
+            node = node['children'].setdefault(frame, {'name': frame, 'value': 0, 'children': {}})
+            node['value'] += count
+
+    rects = []
+
+    def layout(node, x, depth):
+        node_width = node['value'] / max(root['value'], 1) * width
+        if node_width < 0.5:
+            return
+        rects.append((x, depth, node_width, node['name'], node['value']))
+        child_x = x
+        for child in node['children'].values():
+            layout(child, child_x, depth + 1)
+            child_x += child['value'] / root['value'] * width
+
+    layout(root, 0.0, 0)
+    max_depth = max((depth for _, depth, _, _, _ in rects), default=0)
+    height = (max_depth + 3) * row_height
+
+    lines = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" font-family="monospace" font-size="11">',
+        f'<text x="4" y="{row_height - 4}">{html.escape(title)}</text>',
+    ]
+    for x, depth, rect_width, name, value in rects:
+        y = height - (depth + 1) * row_height
+        hue = int(hashlib.md5(name.encode('utf-8')).hexdigest()[:2], 16) % 60
+        label = name[:max(int(rect_width / 7) - 1, 0)]
+        lines.append(
+            f'<g><title>{html.escape(name)} ({value} samples)</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{rect_width:.1f}" height="{row_height - 1}" fill="hsl({hue},85%,60%)"/>'
+            f'<text x="{x + 2:.1f}" y="{y + row_height - 4}">{html.escape(label)}</text></g>'
+        )
+    lines.append('</svg>')
+
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines))
+
+
+async def profiling_middleware(request: Request, call_next):
+    """Profiles requests enabled by a signed header or PROFILE_ALL_REQUESTS"""
+    if not (PROFILE_ALL_REQUESTS or verify_signature(request)):
+        return await call_next(request)
+
+    timings = PhaseTimings()
+    token = _phase_timings.set(timings)
+    sampler = StackSampler(threading.get_ident())
+    sampler.start()
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        total = time.perf_counter() - start
+        sampler.stop()
+        _phase_timings.reset(token)
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profile_id = f'{int(time.time() * 1000)}-{request.method}-{re.sub(r"[^A-Za-z0-9]+", "_", request.url.path).strip("_")}'
+    write_folded_stacks(sampler.stacks, os.path.join(PROFILE_DIR, f'{profile_id}.folded'))
+    write_flamegraph_svg(sampler.stacks, os.path.join(PROFILE_DIR, f'{profile_id}.svg'), f'{request.method} {request.url.path}')
+
+    response.headers['Server-Timing'] = timings.server_timing(total)
+    response.headers['X-Profile-Id'] = profile_id
+    return response
@@ -0,0 +1,294 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import deque
+from typing import Optional
+
+import httpx
+
+from integrations.integration_item import IntegrationItem, PartialItemList
+from redis_client import add_key_value_redis, get_value_redis
+from snapshots import content_hash, snapshot_version
+
+logger = logging.getLogger(__name__)
+
+# Per-endpoint deadlines in seconds, keyed by '<provider>.<endpoint>'
+ENDPOINT_DEADLINES = {
+    'airtable.bases': 10,
+    'airtable.tables': 10,
+    'airtable.records': 15,
+    'notion.search': 10,
+    'notion.block_children': 10,
+    'hubspot.objects': 10,
+    'hubspot.batch_upsert': 30,
+}
+DEFAULT_DEADLINE_SECONDS = 10
+
+FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', 5))
+RECOVERY_SECONDS = int(os.environ.get('CIRCUIT_RECOVERY_SECONDS', 30))
+
+HEDGING_ENABLED = os.environ.get('HEDGED_REQUESTS', '1') == '1'
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+LAST_GOOD_EXPIRE_SECONDS = 24 * 3600
+
+
+class UpstreamUnavailableError(Exception):
+    """Raised when a provider's circuit is open or a request misses its deadline"""
+
+    def __init__(self, provider: str, reason: str):
+        super().__init__(f'{provider} unavailable: {reason}')
+        self.provider = provider
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures and lets a single probe through once recovered"""
+
+    def __init__(self, failure_threshold: int = FAILURE_THRESHOLD, recovery_seconds: int = RECOVERY_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def allow_request(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if self.probing or time.monotonic() - self.opened_at < self.recovery_seconds:
+            return False
+        self.probing = True
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+    def release_probe(self):
+        """Frees the probe slot without deciding the circuit's state"""
+        self.probing = False
+
+
+class LatencyTracker:
+    """Rolling window of request latencies"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.samples = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def p95(self):
+        if len(self.samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+
+class RateLimiter:
+    """Token bucket allowing `rate` requests per `per` seconds.
+
+    Bursts of up to `rate` requests go out at once, after which requests are
+    spaced out as tokens refill. Usable as an async context manager, so it can
+    stand in for a semaphore as a request budget.
+    """
+
+    def __init__(self, rate: int, per: float = 1.0):
+        self.rate = rate
+        self.per = per
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) * self.per / self.rate)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+_breakers = {}
+_latencies = {}
+
+
+def get_breaker(provider: str) -> CircuitBreaker:
+    return _breakers.setdefault(provider, CircuitBreaker())
+
+
+def get_latency_tracker(provider: str, endpoint: str) -> LatencyTracker:
+    return _latencies.setdefault(f'{provider}.{endpoint}', LatencyTracker())
+
+
+async def _send(client: httpx.AsyncClient, tracker: LatencyTracker, method: str, url: str, deadline: float, **kwargs):
+    """Sends one attempt, recording its latency even when it times out or is cancelled"""
+    start = time.monotonic()
+    try:
+        # httpx's own timeouts default to 5 seconds, so they are aligned with the deadline
+        return await asyncio.wait_for(
+            client.request(method, url, timeout=httpx.Timeout(deadline), **kwargs), deadline
+        )
+    finally:
+        tracker.record(min(time.monotonic() - start, deadline))
+
+
+async def _send_hedged(
+    client: httpx.AsyncClient,
+    tracker: LatencyTracker,
+    method: str,
+    url: str,
+    deadline: float,
+    budget=None,
+    **kwargs,
+):
+    """Starts a second attempt once the first outlives the endpoint's p95.
+
+    The first 2xx response wins; an error response or exception only wins
+    once no attempt is left, so a hedge's 429 never beats a slower 200. The
+    hedge takes its own slot from `budget` so it counts against the caller's
+    request budget, and only gets what is left of the deadline so the whole
+    call never outlives it.
+    """
+    hedge_delay = tracker.p95()
+    if hedge_delay is None or hedge_delay >= deadline:
+        return await _send(client, tracker, method, url, deadline, **kwargs)
+
+    start = time.monotonic()
+
+    async def send_remaining():
+        remaining = deadline - (time.monotonic() - start)
+        if remaining <= 0:
+            raise asyncio.TimeoutError()
+        return await _send(client, tracker, method, url, remaining, **kwargs)
+
+    async def send_hedge():
+        if budget is None:
+            return await send_remaining()
+        async with budget:
+            return await send_remaining()
+
+    primary = asyncio.create_task(_send(client, tracker, method, url, deadline, **kwargs))
+    attempts = {primary}
+    try:
+        done, _ = await asyncio.wait(attempts, timeout=hedge_delay)
+        if not done:
+            attempts.add(asyncio.create_task(send_hedge()))
+
+        pending = attempts
+        fallback = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for attempt in done:
+                if attempt.exception() is None and attempt.result().is_success:
+                    return attempt.result()
+                if fallback is None or attempt is primary:
+                    fallback = attempt
+        return fallback.result()
+    finally:
+        for attempt in attempts:
+            attempt.cancel()
+
+
+async def upstream_request(
+    client: httpx.AsyncClient,
+    provider: str,
+    endpoint: str,
+    method: str,
+    url: str,
+    hedge: bool = False,
+    budget=None,
+    **kwargs,
+) -> httpx.Response:
+    """Sends a provider request under its deadline and circuit breaker.
+
+    Only pass `hedge=True` for idempotent reads, since a hedged request may
+    reach the provider twice. Callers holding a slot of a request budget (a
+    semaphore or `RateLimiter`) pass it as `budget` so the hedge waits for a
+    slot of its own.
+    """
+    breaker = get_breaker(provider)
+    if not breaker.allow_request():
+        raise UpstreamUnavailableError(provider, 'circuit open')
+
+    is_probe = breaker.opened_at is not None
+    tracker = get_latency_tracker(provider, endpoint)
+    deadline = ENDPOINT_DEADLINES.get(f'{provider}.{endpoint}', DEFAULT_DEADLINE_SECONDS)
+    try:
+        if hedge and HEDGING_ENABLED:
+            response = await _send_hedged(client, tracker, method, url, deadline, budget, **kwargs)
+        else:
+            response = await _send(client, tracker, method, url, deadline, **kwargs)
+    except (asyncio.TimeoutError, httpx.TransportError) as e:
+        breaker.record_failure()
+        logger.error(f"{provider} {endpoint} request failed: {e!r}")
+        raise UpstreamUnavailableError(provider, f'{endpoint} failed') from e
+    finally:
+        # A probe that was cancelled or hit an unexpected error must not hold the circuit
+        if is_probe:
+            breaker.release_probe()
+
+    if response.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return response
+
+
+async def load_with_fallback(provider: str, credentials: str, loader, options: Optional[dict] = None):
+    """Runs `loader` and keeps its result as the last good snapshot for these credentials.
+
+    `options` are the loader arguments that change what is loaded, so each
+    combination keeps its own snapshot. The snapshot is only rewritten when
+    its content version changes, and never from a `PartialItemList`. When
+    the provider is unavailable the last good snapshot is served instead.
+    Items are returned as dicts, in a `PartialItemList` when partial.
+    """
+    access_token = json.loads(credentials).get('access_token', '')
+    key_material = json.dumps({'access_token': access_token, 'options': options or {}}, sort_keys=True)
+    cache_key = f'{provider}_last_good:{hashlib.sha256(key_material.encode("utf-8")).hexdigest()}'
+    try:
+        items = await loader()
+    except UpstreamUnavailableError:
+        cached = await get_value_redis(cache_key)
+        if not cached:
+            raise
+        logger.info(f"Serving last good {provider} snapshot")
+        return json.loads(cached)
+
+    if items is None:
+        return items
+
+    item_dicts = [item.to_dict() if isinstance(item, IntegrationItem) else item for item in items]
+    if isinstance(items, PartialItemList):
+        logger.info(f"Not keeping partial {provider} load as last good snapshot")
+        return PartialItemList(item_dicts)
+
+    version = snapshot_version({item['id']: content_hash(item) for item in item_dicts})
+    stored_version = await get_value_redis(f'{cache_key}:version')
+    if isinstance(stored_version, bytes):
+        stored_version = stored_version.decode('utf-8')
+    if stored_version != version:
+        await add_key_value_redis(cache_key, json.dumps(item_dicts), expire=LAST_GOOD_EXPIRE_SECONDS)
+        await add_key_value_redis(f'{cache_key}:version', version, expire=LAST_GOOD_EXPIRE_SECONDS)
+    return item_dicts
@@ -0,0 +1,89 @@
+import hashlib
+import json
+from typing import Optional
+
+from fastapi import Response
+
+from integrations.integration_item import IntegrationItem, PartialItemList
+from redis_client import add_key_value_redis, get_value_redis
+
+SNAPSHOT_EXPIRE_SECONDS = 7 * 24 * 3600
+SNAPSHOT_VERSION_HEADER = 'X-Snapshot-Version'
+INCOMPLETE_HEADER = 'X-Items-Incomplete'
+
+
+def _item_dict(item) -> dict:
+    """Items come back as IntegrationItem objects or, from caches, as plain dicts"""
+    return item.to_dict() if isinstance(item, IntegrationItem) else dict(item)
+
+
+def content_hash(item: dict) -> str:
+    """Hash of everything the client renders, ignoring the delta marker"""
+    payload = {key: value for key, value in item.items() if key != 'delta'}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+def snapshot_version(hashes: dict) -> str:
+    """Content-addressed version, identical item sets always share a version"""
+    return hashlib.sha256(json.dumps(sorted(hashes.items())).encode('utf-8')).hexdigest()[:16]
+
+
+async def diff_items(integration: str, user_id: str, org_id: str, items: list, client_version: Optional[str] = None):
+    """Diffs `items` against the snapshot last served to this integration, user and org.
+
+    When `client_version` matches the stored snapshot only added, modified and
+    removed items are returned, marked through `delta`; otherwise the full list
+    is returned. The current items become the stored snapshot either way.
+    Returns the items and the new snapshot version.
+    """
+    key = f'{integration}_snapshot:{org_id}:{user_id}'
+    item_dicts = [_item_dict(item) for item in items]
+    hashes = {item['id']: content_hash(item) for item in item_dicts}
+    version = snapshot_version(hashes)
+
+    stored = await get_value_redis(key)
+    previous = json.loads(stored) if stored else None
+    if previous is None or previous['version'] != version:
+        await add_key_value_redis(key, json.dumps({'version': version, 'hashes': hashes}), expire=SNAPSHOT_EXPIRE_SECONDS)
+
+    if not client_version or previous is None or previous['version'] != client_version:
+        return item_dicts, version
+
+    previous_hashes = previous['hashes']
+    changes = []
+    for item in item_dicts:
+        previous_hash = previous_hashes.get(item['id'])
+        if previous_hash == hashes[item['id']]:
+            continue
+        item['delta'] = 'added' if previous_hash is None else 'modified'
+        changes.append(item)
+    for removed_id in previous_hashes.keys() - hashes.keys():
+        changes.append(IntegrationItem(id=removed_id, delta='removed').to_dict())
+
+    return changes, version
+
+
+async def serve_items(
+    integration: str,
+    items: list,
+    response: Response,
+    client_version: Optional[str] = None,
+    user_id: Optional[str] = None,
+    org_id: Optional[str] = None,
+):
+    """Returns `items`, or only their changes, and sets the snapshot version header.
+
+    Diffing needs to know whose snapshot to compare against, so without a
+    user and org the items are returned unchanged. A `PartialItemList` is
+    returned whole and flagged through the incomplete header; it is neither
+    diffed nor stored, so the client keeps its previous version.
+    """
+    if isinstance(items, PartialItemList):
+        response.headers[INCOMPLETE_HEADER] = 'true'
+        return items
+    if items is None or not user_id or not org_id:
+        return items
+
+    items, version = await diff_items(integration, user_id, org_id, items, client_version)
+    response.headers[SNAPSHOT_VERSION_HEADER] = version
+    return items
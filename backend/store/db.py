@@ -2,8 +2,11 @@ import json
 import os
 from typing import Dict, Any, Optional
 
+from profiling import timed_phase
+
 DB_FILE = os.path.join(os.path.dirname(__file__), 'db.json')
 
+@timed_phase('db')
 def read_db() -> Dict[str, Any]:
     """Read the database file"""
     try:
@@ -23,6 +26,7 @@ def read_db() -> Dict[str, Any]:
             json.dump(initial_data, f, indent=4)
         return initial_data
 
+@timed_phase('db')
 def write_db(data: Dict[str, Any]) -> None:
     """Write to the database file"""
     os.makedirs(os.path.dirname(DB_FILE), exist_ok=True)
@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import resilience
+import snapshots
+from integrations import airtable, hubspot
+
+
+@pytest.fixture
+def redis_store(monkeypatch):
+    """In-memory stand-in for the Redis helpers used by snapshots, resilience and Airtable"""
+    store = {}
+
+    async def add_key_value_redis(key, value, expire=None):
+        store[key] = value.encode('utf-8') if isinstance(value, str) else value
+
+    async def get_value_redis(key):
+        return store.get(key)
+
+    for module in (snapshots, resilience, airtable):
+        monkeypatch.setattr(module, 'add_key_value_redis', add_key_value_redis)
+        monkeypatch.setattr(module, 'get_value_redis', get_value_redis)
+    return store
+
+
+@pytest.fixture(autouse=True)
+def reset_resilience_state():
+    # Limiters hold locks bound to the event loop of the test that created them
+    for registry in (resilience._breakers, resilience._latencies, airtable._base_limiters, hubspot._account_limiters):
+        registry.clear()
+    yield
+    for registry in (resilience._breakers, resilience._latencies, airtable._base_limiters, hubspot._account_limiters):
+        registry.clear()
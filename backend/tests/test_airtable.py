@@ -0,0 +1,147 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from integrations import airtable
+from integrations.integration_item import PartialItemList
+
+BASE = {'id': 'app1', 'name': 'Base'}
+TABLE = {
+    'id': 'tbl1',
+    'name': 'Tasks',
+    'primaryFieldId': 'fld1',
+    'fields': [{'id': 'fld1', 'name': 'Name'}, {'id': 'fld2', 'name': 'Status'}, {'id': 'fld3', 'name': 'Notes'}],
+}
+
+
+def _records(handler, table=TABLE, fields=None) -> list:
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return [
+                page
+                async for page in airtable.fetch_table_records(client, 'token', BASE, table, fields)
+            ]
+
+    return asyncio.run(run())
+
+
+def test_records_are_paged_by_offset():
+    offsets = []
+
+    def handler(request):
+        offset = request.url.params.get('offset')
+        offsets.append(offset)
+        if offset is None:
+            return httpx.Response(200, json={'records': [{'id': 'rec1', 'fields': {'Name': 'a'}}], 'offset': 'next'})
+        return httpx.Response(200, json={'records': [{'id': 'rec2', 'fields': {'Name': 'b'}}]})
+
+    pages = _records(handler)
+    assert offsets == [None, 'next']
+    assert [[item.id for item in page] for page in pages] == [['rec1_Record'], ['rec2_Record']]
+    assert pages[1][0].name == 'b'
+    assert pages[1][0].parent_id == 'tbl1_Table'
+
+
+def test_projection_keeps_known_fields_and_the_primary_field():
+    requested = []
+
+    def handler(request):
+        requested.append(request.url.params.get_list('fields[]'))
+        return httpx.Response(
+            200, json={'records': [{'id': 'rec1', 'fields': {'Name': 'a', 'Status': 'done'}}]}
+        )
+
+    pages = _records(handler, fields=['Status', 'Owner'])
+    assert requested == [['Status', 'Name']]
+    assert pages[0][0].name == 'a'
+    assert pages[0][0].properties == {'Status': 'done'}
+
+
+def test_tables_without_requested_fields_are_skipped():
+    def handler(request):
+        raise AssertionError('no request expected')
+
+    assert _records(handler, fields=['Owner']) == []
+
+
+def test_failed_page_raises_bad_gateway():
+    with pytest.raises(HTTPException) as exc_info:
+        _records(lambda request: httpx.Response(403, json={}))
+    assert exc_info.value.status_code == 502
+
+
+def test_merged_pages_raise_the_first_failure():
+    async def pages():
+        yield ['a']
+
+    async def failing():
+        raise HTTPException(status_code=502)
+        yield
+
+    async def run():
+        return [page async for page in airtable._merge_pages([pages(), failing()])]
+
+    with pytest.raises(HTTPException):
+        asyncio.run(run())
+
+
+def _cache_schema(redis_store, tables):
+    asyncio.run(airtable.add_key_value_redis('airtable_schema:app1', json.dumps({
+        'base_fingerprint': airtable._fingerprint(BASE),
+        'validated_at': time.time() - airtable.SCHEMA_MIN_REVALIDATE_SECONDS,
+        'tables': tables,
+    })))
+
+
+def test_unknown_field_revalidates_schema_and_retries(redis_store):
+    renamed = dict(TABLE, fields=[{'id': 'fld1', 'name': 'Name'}, {'id': 'fld2', 'name': 'State'}])
+    _cache_schema(redis_store, [renamed])
+    requested = []
+
+    def handler(request):
+        if request.url.path.startswith('/v0/meta'):
+            return httpx.Response(200, json={'tables': [TABLE]})
+        requested.append(request.url.params.get_list('fields[]'))
+        if 'State' in requested[-1]:
+            return httpx.Response(422, json={'error': {'type': 'UNKNOWN_FIELD_NAME', 'message': 'Unknown field name: "State"'}})
+        return httpx.Response(200, json={'records': [{'id': 'rec1', 'fields': {'Name': 'a', 'Status': 'done'}}]})
+
+    pages = _records(handler, table=renamed, fields=['State', 'Status'])
+    assert requested == [['State', 'Name'], ['Status', 'Name']]
+    assert pages[0][0].properties == {'Status': 'done'}
+
+
+def test_field_missing_from_cached_schema_revalidates_it(redis_store):
+    _cache_schema(redis_store, [dict(TABLE, fields=[{'id': 'fld1', 'name': 'Name'}])])
+
+    def handler(request):
+        return httpx.Response(200, json={'tables': [TABLE]})
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            cached = await airtable.fetch_projected_tables(client, 'token', BASE, ['Name'])
+            refreshed = await airtable.fetch_projected_tables(client, 'token', BASE, ['Status'])
+        return cached, refreshed
+
+    cached, refreshed = asyncio.run(run())
+    assert len(cached[0]['fields']) == 1
+    assert refreshed == [TABLE]
+
+
+def test_failed_table_listing_makes_items_partial(redis_store, monkeypatch):
+    async_client = httpx.AsyncClient
+
+    def handler(request):
+        if request.url.path == '/v0/meta/bases':
+            return httpx.Response(200, json={'bases': [BASE]})
+        return httpx.Response(429, json={})
+
+    monkeypatch.setattr(airtable.httpx, 'AsyncClient', lambda: async_client(transport=httpx.MockTransport(handler)))
+
+    items = asyncio.run(airtable.get_items_airtable(json.dumps({'access_token': 'token'})))
+    assert isinstance(items, PartialItemList)
+    assert [item.id for item in items] == ['app1_Base']
@@ -0,0 +1,103 @@
+import asyncio
+import codecs
+import io
+import json
+
+import httpx
+import pytest
+from fastapi import UploadFile
+
+from integrations import hubspot
+
+
+def _upload(data: bytes) -> UploadFile:
+    return UploadFile(file=io.BytesIO(data), filename='contacts')
+
+
+def _contacts(data: bytes) -> list:
+    async def run():
+        return [entry async for entry in hubspot._iter_contacts(_upload(data))]
+
+    return asyncio.run(run())
+
+
+@pytest.fixture
+def hubspot_api(monkeypatch):
+    """Records batch upsert requests and answers them through `respond`"""
+    requests = []
+    respond = {'handler': lambda inputs: httpx.Response(200, json={'results': inputs})}
+    async_client = httpx.AsyncClient
+    invalidated = []
+
+    def handler(request):
+        inputs = json.loads(request.content)['inputs']
+        requests.append(inputs)
+        return respond['handler'](inputs)
+
+    async def delete_key_redis(key):
+        invalidated.append(key)
+
+    monkeypatch.setattr(hubspot.httpx, 'AsyncClient', lambda: async_client(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(hubspot.db, 'get_hubspot_user_id', lambda user_id, org_id: 'hub')
+    monkeypatch.setattr(hubspot, 'delete_key_redis', delete_key_redis)
+    return requests, respond, invalidated
+
+
+def _upsert(data: bytes) -> dict:
+    credentials = json.dumps({'access_token': 'token', 'user_id': 'user', 'org_id': 'org'})
+    return asyncio.run(hubspot.upsert_contacts_hubspot(credentials, _upload(data)))
+
+
+def test_ndjson_lines_are_read_across_chunks(monkeypatch):
+    monkeypatch.setattr(hubspot, 'UPLOAD_CHUNK_BYTES', 7)
+    data = codecs.BOM_UTF8 + b'{"email": "a@x.io"}\n\nnot json\n[1]\n{"email": "b@x.io"}'
+
+    assert _contacts(data) == [
+        (1, {'email': 'a@x.io'}, None),
+        (3, None, 'Invalid JSON'),
+        (4, None, 'Contact is not a JSON object'),
+        (5, {'email': 'b@x.io'}, None),
+    ]
+
+
+def test_json_array_is_detected_after_bom_and_whitespace():
+    data = codecs.BOM_UTF8 + b'\n  [{"email": "a@x.io"}, "b"]'
+
+    assert _contacts(data) == [(1, {'email': 'a@x.io'}, None), (2, None, 'Contact is not a JSON object')]
+
+
+def test_batch_error_ids_are_read_from_error_context():
+    error = {'context': {'ids': ['a@x.io', 7], 'message': 'not a list'}}
+
+    assert hubspot._batch_error_ids(error) == {'a@x.io', '7'}
+
+
+def test_contacts_are_upserted_in_batches(hubspot_api):
+    requests, _, invalidated = hubspot_api
+    lines = [json.dumps({'email': f'{i}@x.io'}) for i in range(hubspot.BATCH_SIZE + 1)]
+
+    result = _upsert('\n'.join(lines).encode('utf-8'))
+    assert sorted(len(inputs) for inputs in requests) == [1, hubspot.BATCH_SIZE]
+    assert result == {'total': hubspot.BATCH_SIZE + 1, 'succeeded': hubspot.BATCH_SIZE + 1, 'failed': 0, 'errors': []}
+    assert invalidated == ['hubspot_items:hub']
+
+
+def test_malformed_entries_and_batch_errors_are_reported_per_record(hubspot_api):
+    _, respond, _ = hubspot_api
+    respond['handler'] = lambda inputs: httpx.Response(207, json={
+        'results': inputs[1:],
+        'errors': [
+            {'status': 'error', 'message': 'Invalid email', 'context': {'ids': [inputs[0]['id']]}},
+            {'status': 'error', 'message': 'Unrelated'},
+        ],
+    })
+
+    result = _upsert(b'{"email": "bad"}\n{"email": "a@x.io"}\nnot json\n{"name": "no email"}')
+    assert result['total'] == 4
+    assert result['succeeded'] == 1
+    assert result['errors'] == [
+        {'id': None, 'position': 3, 'status': 'INVALID_INPUT', 'message': 'Invalid JSON'},
+        {'id': None, 'position': 4, 'status': 'INVALID_INPUT', 'message': 'Missing email'},
+        {'id': 'bad', 'status': 'error', 'message': 'Invalid email'},
+        {'id': None, 'status': 'error', 'message': 'Unrelated'},
+    ]
@@ -0,0 +1,86 @@
+import asyncio
+
+import httpx
+import pytest
+
+from integrations import notion
+from integrations.integration_item import IntegrationItem, PartialItemList
+
+
+def _block(block_id: str, has_children: bool = False, block_type: str = 'paragraph') -> dict:
+    return {'id': block_id, 'type': block_type, block_type: {'rich_text': [{'plain_text': block_id}]}, 'has_children': has_children}
+
+
+@pytest.fixture
+def notion_api(monkeypatch):
+    """Serves block children from a dict of block id to child blocks"""
+    tree = {}
+    requests = []
+    async_client = httpx.AsyncClient
+
+    def handler(request):
+        block_id = request.url.path.split('/')[-2]
+        requests.append(block_id)
+        if block_id not in tree:
+            return httpx.Response(404, json={})
+        return httpx.Response(200, json={'results': tree[block_id], 'has_more': False})
+
+    monkeypatch.setattr(notion.httpx, 'AsyncClient', lambda: async_client(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(notion, 'RATE_LIMIT_BACKOFF_SECONDS', 0)
+    return tree, requests
+
+
+def _traverse(**kwargs):
+    roots = [IntegrationItem(id='page1', type='page'), IntegrationItem(id='page2', type='page')]
+    return roots, asyncio.run(notion.traverse_block_tree('token', roots, **kwargs))
+
+
+def test_blocks_are_linked_and_synced_blocks_expanded_once(notion_api):
+    tree, requests = notion_api
+    tree.update({
+        'page1': [_block('synced', has_children=True), _block('db', has_children=True, block_type='child_database')],
+        'page2': [_block('synced', has_children=True)],
+        'synced': [_block('leaf')],
+    })
+
+    roots, blocks = _traverse()
+    assert not isinstance(blocks, PartialItemList)
+    assert sorted(item.id for item in blocks) == ['db', 'leaf', 'synced']
+    assert roots[0].children == ['synced', 'db']
+    assert roots[1].children == []
+    assert sorted(requests) == ['page1', 'page2', 'synced']
+
+
+def test_max_blocks_returns_partial_items(notion_api):
+    tree, _ = notion_api
+    tree.update({'page1': [_block('a'), _block('b')], 'page2': []})
+
+    _, blocks = _traverse(max_blocks=1)
+    assert isinstance(blocks, PartialItemList)
+    assert len(blocks) == 1
+
+
+def test_failed_subtree_returns_partial_items(notion_api):
+    tree, _ = notion_api
+    tree.update({'page1': [_block('a', has_children=True)], 'page2': []})
+
+    _, blocks = _traverse()
+    assert isinstance(blocks, PartialItemList)
+    assert [item.id for item in blocks] == ['a']
+
+
+def test_rate_limit_retries_are_capped(monkeypatch):
+    monkeypatch.setattr(notion, 'RATE_LIMIT_BACKOFF_SECONDS', 0)
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(429, headers={'Retry-After': '0'})
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await notion.fetch_block_children(client, 'token', 'page1', asyncio.Semaphore(1))
+
+    children, fetched_all = asyncio.run(run())
+    assert (children, fetched_all) == ([], False)
+    assert len(calls) == notion.MAX_RATE_LIMIT_RETRIES + 1
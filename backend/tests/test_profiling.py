@@ -0,0 +1,42 @@
+import hashlib
+import hmac
+import time
+
+from starlette.requests import Request
+
+import profiling
+
+
+def _request(signature: str) -> Request:
+    return Request({
+        'type': 'http',
+        'method': 'GET',
+        'path': '/integrations/notion/load',
+        'query_string': b'',
+        'headers': [(profiling.PROFILE_HEADER.lower().encode('latin-1'), signature.encode('utf-8'))],
+    })
+
+
+def _sign(secret: str, timestamp: int) -> str:
+    message = f'{timestamp}:GET:/integrations/notion/load'.encode('utf-8')
+    return hmac.new(secret.encode('utf-8'), message, hashlib.sha256).hexdigest()
+
+
+def test_valid_signature_is_accepted(monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILING_SECRET', 'secret')
+    timestamp = int(time.time())
+
+    assert profiling.verify_signature(_request(f'{timestamp}:{_sign("secret", timestamp)}'))
+
+
+def test_non_ascii_signature_is_rejected(monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILING_SECRET', 'secret')
+
+    assert not profiling.verify_signature(_request(f'{int(time.time())}:é'))
+
+
+def test_stale_signature_is_rejected(monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILING_SECRET', 'secret')
+    timestamp = int(time.time()) - profiling.SIGNATURE_MAX_AGE_SECONDS - 1
+
+    assert not profiling.verify_signature(_request(f'{timestamp}:{_sign("secret", timestamp)}'))
@@ -0,0 +1,276 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import resilience
+from integrations.integration_item import IntegrationItem, PartialItemList
+from resilience import UpstreamUnavailableError, load_with_fallback, upstream_request
+
+
+def _client(handler) -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def _open_breaker(provider: str) -> resilience.CircuitBreaker:
+    breaker = resilience.get_breaker(provider)
+    breaker.failures = breaker.failure_threshold
+    breaker.opened_at = 0.0
+    return breaker
+
+
+def _warm_up(provider: str, endpoint: str, seconds: float):
+    tracker = resilience.get_latency_tracker(provider, endpoint)
+    for _ in range(resilience.HEDGE_MIN_SAMPLES):
+        tracker.record(seconds)
+
+
+def test_breaker_opens_after_consecutive_failures():
+    async def handler(request):
+        return httpx.Response(500)
+
+    async def run():
+        async with _client(handler) as client:
+            for _ in range(resilience.FAILURE_THRESHOLD):
+                await upstream_request(client, 'test', 'items', 'GET', 'http://upstream/items')
+            with pytest.raises(UpstreamUnavailableError):
+                await upstream_request(client, 'test', 'items', 'GET', 'http://upstream/items')
+
+    asyncio.run(run())
+
+
+def test_breaker_closes_after_successful_probe():
+    async def handler(request):
+        return httpx.Response(200)
+
+    async def run():
+        breaker = _open_breaker('test')
+        async with _client(handler) as client:
+            response = await upstream_request(client, 'test', 'items', 'GET', 'http://upstream/items')
+        assert response.status_code == 200
+        assert breaker.opened_at is None
+
+    asyncio.run(run())
+
+
+def test_cancelled_probe_releases_circuit():
+    slow = asyncio.Event()
+
+    async def handler(request):
+        if not slow.is_set():
+            slow.set()
+            await asyncio.sleep(10)
+        return httpx.Response(200)
+
+    async def run():
+        breaker = _open_breaker('test')
+        async with _client(handler) as client:
+            probe = asyncio.create_task(upstream_request(client, 'test', 'items', 'GET', 'http://upstream/items'))
+            await slow.wait()
+            probe.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await probe
+
+            assert not breaker.probing
+            response = await upstream_request(client, 'test', 'items', 'GET', 'http://upstream/items')
+        assert response.status_code == 200
+
+    asyncio.run(run())
+
+
+def test_probe_with_unexpected_error_releases_circuit():
+    async def run():
+        breaker = _open_breaker('test')
+        client = _client(lambda request: httpx.Response(200))
+        await client.aclose()
+        with pytest.raises(RuntimeError):
+            await upstream_request(client, 'test', 'items', 'GET', 'http://upstream/items')
+        assert not breaker.probing
+
+    asyncio.run(run())
+
+
+def test_request_timeout_matches_endpoint_deadline():
+    timeouts = []
+
+    async def handler(request):
+        timeouts.append(request.extensions['timeout'])
+        return httpx.Response(200)
+
+    async def run():
+        async with _client(handler) as client:
+            await upstream_request(client, 'hubspot', 'batch_upsert', 'POST', 'http://upstream/batch')
+
+    asyncio.run(run())
+    assert timeouts[0]['read'] == resilience.ENDPOINT_DEADLINES['hubspot.batch_upsert']
+
+
+def test_timed_out_attempts_are_recorded(monkeypatch):
+    monkeypatch.setitem(resilience.ENDPOINT_DEADLINES, 'test.items', 0.05)
+
+    async def handler(request):
+        await asyncio.sleep(1)
+        return httpx.Response(200)
+
+    async def run():
+        async with _client(handler) as client:
+            with pytest.raises(UpstreamUnavailableError):
+                await upstream_request(client, 'test', 'items', 'GET', 'http://upstream/items')
+
+    asyncio.run(run())
+    assert list(resilience.get_latency_tracker('test', 'items').samples) == [0.05]
+
+
+def test_hedge_wins_when_primary_is_slow():
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            await asyncio.sleep(1)
+        return httpx.Response(200, json={'attempt': len(calls)})
+
+    async def run():
+        _warm_up('test', 'items', 0.01)
+        async with _client(handler) as client:
+            return await upstream_request(client, 'test', 'items', 'GET', 'http://upstream/items', hedge=True)
+
+    response = asyncio.run(run())
+    assert response.json() == {'attempt': 2}
+
+
+def test_hedge_error_response_does_not_beat_slower_success():
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            await asyncio.sleep(0.1)
+            return httpx.Response(200)
+        return httpx.Response(429)
+
+    async def run():
+        _warm_up('test', 'items', 0.01)
+        async with _client(handler) as client:
+            return await upstream_request(client, 'test', 'items', 'GET', 'http://upstream/items', hedge=True)
+
+    assert asyncio.run(run()).status_code == 200
+    assert len(calls) == 2
+
+
+def test_hedge_waits_for_a_semaphore_slot():
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        await asyncio.sleep(0.1)
+        return httpx.Response(200)
+
+    async def run():
+        _warm_up('test', 'items', 0.01)
+        semaphore = asyncio.Semaphore(1)
+        async with _client(handler) as client:
+            async with semaphore:
+                return await upstream_request(
+                    client, 'test', 'items', 'GET', 'http://upstream/items', hedge=True, budget=semaphore
+                )
+
+    assert asyncio.run(run()).status_code == 200
+    assert len(calls) == 1
+
+
+def test_fallback_is_kept_per_loader_options(redis_store):
+    credentials = json.dumps({'access_token': 'token'})
+
+    async def pages():
+        return [IntegrationItem(id='page')]
+
+    async def pages_and_blocks():
+        return [IntegrationItem(id='page'), IntegrationItem(id='block')]
+
+    async def unavailable():
+        raise UpstreamUnavailableError('notion', 'circuit open')
+
+    async def run():
+        await load_with_fallback('notion', credentials, pages, {'include_blocks': False})
+        await load_with_fallback('notion', credentials, pages_and_blocks, {'include_blocks': True})
+        without_blocks = await load_with_fallback('notion', credentials, unavailable, {'include_blocks': False})
+        with_blocks = await load_with_fallback('notion', credentials, unavailable, {'include_blocks': True})
+        return without_blocks, with_blocks
+
+    without_blocks, with_blocks = asyncio.run(run())
+    assert [item['id'] for item in without_blocks] == ['page']
+    assert [item['id'] for item in with_blocks] == ['page', 'block']
+
+
+def test_fallback_is_only_rewritten_when_items_change(redis_store, monkeypatch):
+    credentials = json.dumps({'access_token': 'token'})
+    writes = []
+    add_key_value_redis = resilience.add_key_value_redis
+
+    async def counting_add(key, value, expire=None):
+        writes.append(key)
+        await add_key_value_redis(key, value, expire)
+
+    monkeypatch.setattr(resilience, 'add_key_value_redis', counting_add)
+
+    async def run():
+        for name in ('a', 'a', 'b'):
+            async def loader(name=name):
+                return [IntegrationItem(id='1', name=name)]
+            await load_with_fallback('hubspot', credentials, loader)
+
+    asyncio.run(run())
+    assert len(writes) == 4
+
+
+def test_fallback_reraises_without_snapshot(redis_store):
+    async def unavailable():
+        raise UpstreamUnavailableError('hubspot', 'circuit open')
+
+    with pytest.raises(UpstreamUnavailableError):
+        asyncio.run(load_with_fallback('hubspot', json.dumps({'access_token': 'token'}), unavailable))
+
+
+def test_rate_limiter_spaces_requests_after_a_burst():
+    async def run():
+        limiter = resilience.RateLimiter(5, per=0.1)
+        start = asyncio.get_running_loop().time()
+        for _ in range(10):
+            async with limiter:
+                pass
+        return asyncio.get_running_loop().time() - start
+
+    # The first 5 go out at once and the next 5 wait for tokens to refill
+    assert 0.08 <= asyncio.run(run()) < 0.5
+
+
+def test_partial_load_is_served_but_not_kept(redis_store):
+    credentials = json.dumps({'access_token': 'token'})
+
+    async def partial():
+        return PartialItemList([IntegrationItem(id='page')])
+
+    items = asyncio.run(load_with_fallback('notion', credentials, partial))
+    assert isinstance(items, PartialItemList)
+    assert [item['id'] for item in items] == ['page']
+    assert redis_store == {}
+
+
+def test_hedge_does_not_extend_the_deadline(monkeypatch):
+    monkeypatch.setitem(resilience.ENDPOINT_DEADLINES, 'test.items', 0.3)
+
+    async def handler(request):
+        await asyncio.sleep(1)
+        return httpx.Response(200)
+
+    async def run():
+        _warm_up('test', 'items', 0.1)
+        async with _client(handler) as client:
+            start = asyncio.get_running_loop().time()
+            with pytest.raises(UpstreamUnavailableError):
+                await upstream_request(client, 'test', 'items', 'GET', 'http://upstream/items', hedge=True)
+            return asyncio.get_running_loop().time() - start
+
+    assert asyncio.run(run()) < 0.35
@@ -0,0 +1,65 @@
+import asyncio
+
+from fastapi import Response
+
+from integrations.integration_item import IntegrationItem, PartialItemList
+from snapshots import INCOMPLETE_HEADER, SNAPSHOT_VERSION_HEADER, diff_items, serve_items
+
+
+def test_full_list_without_client_version(redis_store):
+    items, version = asyncio.run(diff_items('notion', 'user', 'org', [IntegrationItem(id='1', name='a')]))
+    assert [item['id'] for item in items] == ['1']
+    assert items[0]['delta'] is None
+    assert version
+
+
+def test_changes_against_current_snapshot(redis_store):
+    async def run():
+        _, version = await diff_items(
+            'notion', 'user', 'org', [IntegrationItem(id='1', name='a'), IntegrationItem(id='2', name='b')]
+        )
+        return await diff_items(
+            'notion', 'user', 'org', [IntegrationItem(id='1', name='changed'), IntegrationItem(id='3', name='c')], version
+        )
+
+    changes, _ = asyncio.run(run())
+    assert {(item['id'], item['delta']) for item in changes} == {('1', 'modified'), ('3', 'added'), ('2', 'removed')}
+
+
+def test_unchanged_items_keep_version_and_send_nothing(redis_store):
+    async def run():
+        items = [IntegrationItem(id='1', name='a')]
+        _, version = await diff_items('hubspot', 'user', 'org', items)
+        changes, new_version = await diff_items('hubspot', 'user', 'org', items, version)
+        return changes, version, new_version
+
+    changes, version, new_version = asyncio.run(run())
+    assert changes == []
+    assert new_version == version
+
+
+def test_stale_client_version_gets_full_list(redis_store):
+    async def run():
+        await diff_items('airtable', 'user', 'org', [IntegrationItem(id='1', name='a')])
+        return await diff_items('airtable', 'user', 'org', [IntegrationItem(id='1', name='b')], 'stale')
+
+    items, _ = asyncio.run(run())
+    assert [(item['id'], item['delta']) for item in items] == [('1', None)]
+
+
+def test_partial_items_are_neither_diffed_nor_stored(redis_store):
+    async def run():
+        items = [IntegrationItem(id='1', name='a'), IntegrationItem(id='2', name='b')]
+        _, version = await diff_items('airtable', 'user', 'org', items)
+        response = Response()
+        served = await serve_items(
+            'airtable', PartialItemList([IntegrationItem(id='1', name='a')]), response, version, 'user', 'org'
+        )
+        changes, _ = await diff_items('airtable', 'user', 'org', items, version)
+        return served, response, changes
+
+    served, response, changes = asyncio.run(run())
+    assert [item.id for item in served] == ['1']
+    assert response.headers[INCOMPLETE_HEADER] == 'true'
+    assert SNAPSHOT_VERSION_HEADER not in response.headers
+    assert changes == []